@@ -60,7 +60,7 @@ class TestElasticSearchIndex:
                 self.index_name,
                 self.doc_type,
                 json.dumps(transaction, cls=DjangoJSONEncoder),
-                transaction["transaction_id"],
+                transaction["generated_unique_transaction_id"],
             )
 
         # Force newly added documents to become searchable.
@@ -1,20 +1,20 @@
 import boto3
+import codecs
+import csv
 import json
 import os
-import pandas as pd
 import psycopg2
-import subprocess
-import tempfile
 
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import datetime
 from django.conf import settings
 from django.core.management import call_command
 from elasticsearch import helpers, TransportError
+from itertools import islice
 from time import perf_counter, sleep
 
 from usaspending_api.awards.v2.lookups.elasticsearch_lookups import INDEX_ALIASES_TO_AWARD_TYPES
-from usaspending_api.common.csv_helpers import count_rows_in_delimited_file
 from usaspending_api.common.helpers.sql_helpers import get_database_dsn_string
 
 # ==============================================================================
@@ -104,35 +104,35 @@ VIEW_COLUMNS = [
     "business_categories",
 ]
 
-UPDATE_DATE_SQL = " AND update_date >= '{}'"
+# Columns sent to Elasticsearch as native JSON. Every other column is sent as a string (or null when empty), which
+# is the document shape the API returns to clients straight from "_source" (e.g. amounts keep their "12.30" text)
+ARRAY_COLUMNS = ["business_categories"]
+JSON_COLUMNS = ["treasury_accounts", "federal_accounts"]
 
-COUNT_SQL = """
-SELECT COUNT(*) AS count
-FROM {view}
-WHERE transaction_fiscal_year={fy}{update_date}
-"""
 
-COPY_SQL = """"COPY (
-    SELECT *
-    FROM {view}
-    WHERE transaction_fiscal_year={fy}{update_date}
-) TO STDOUT DELIMITER ',' CSV HEADER" > '{filename}'
-"""
+def _select_expression(column):
+    if column in ARRAY_COLUMNS:
+        return "NULLIF({0}, '{{}}') AS {0}".format(column)
+    if column in JSON_COLUMNS:
+        return column
+    return "NULLIF({0}::TEXT, '') AS {0}".format(column)
 
-CHECK_IDS_SQL = """
-WITH temp_transaction_ids AS (
-  SELECT *
-  FROM (VALUES {id_list}) AS unique_id_list (generated_unique_transaction_id)
-)
-SELECT transaction_id, generated_unique_transaction_id, update_date
-FROM {view}
-WHERE EXISTS (
-  SELECT *
-  FROM temp_transaction_ids
-  WHERE
-    {view}.generated_unique_transaction_id = temp_transaction_ids.generated_unique_transaction_id
-    AND transaction_fiscal_year={fy}
-)
+
+# Explicit projection keeps the ES documents in sync with VIEW_COLUMNS even if the view gains columns
+SELECT_LIST = ", ".join(_select_expression(column) for column in VIEW_COLUMNS)
+
+UPDATE_DATE_SQL = " AND update_date >= '{}'"
+
+# Postgres builds each document as one line of JSON. CSV format with control characters as the quote and delimiter
+# is used so the JSON is written verbatim (TEXT format would escape every backslash in the JSON strings).
+COPY_SQL = """COPY (
+    SELECT row_to_json(t)
+    FROM (
+        SELECT {columns}
+        FROM {view}
+        WHERE transaction_fiscal_year={fy}{update_date}
+    ) AS t
+) TO STDOUT WITH (FORMAT CSV, QUOTE E'\\x01', DELIMITER E'\\x02')
 """
 
 # ==============================================================================
@@ -150,6 +150,15 @@ AWARD_DESC_CATEGORIES = {
 
 UNIVERSAL_TRANSACTION_ID_NAME = "generated_unique_transaction_id"
 
+# Number of documents used to estimate the average document size when sizing ES ingest batches
+CHUNK_SIZE_SAMPLE_DOCS = 200
+# Upper bounds for an ES ingest batch, and the byte limit for each bulk request sent from it
+ES_MAX_BATCH_DOCS = 50000
+ES_MAX_CHUNK_BYTES = 50 * 1024 * 1024
+# Concurrent bulk requests and documents per bulk request used by parallel_bulk
+ES_BULK_THREAD_COUNT = 8
+ES_BULK_CHUNK_SIZE = 4000
+
 
 class DataJob:
     def __init__(self, *args):
@@ -157,30 +166,26 @@ class DataJob:
         self.index = args[1]
         self.fy = args[2]
         self.csv = args[3]
-        self.count = None
 
 
-# ==============================================================================
-# Helper functions for several Django management commands focused on ETL into a Elasticsearch cluster
-# ==============================================================================
-
-
-def convert_postgres_array_as_string_to_list(array_as_string: str) -> list:
+class LineCountingWriter:
     """
-        Postgres arrays are stored in CSVs as strings. Elasticsearch is able to handle lists of items, but needs to
-        be passed a list instead of a string. In the case of an empty array, return null.
-        For example, "{this,is,a,postgres,array}" -> ["this", "is", "a", "postgres", "array"].
+        Thin wrapper around a binary file object which counts the newlines written through it.
+        Used to tally the rows of a COPY ... TO STDOUT stream as it is written, without a separate COUNT(*) query.
     """
-    return array_as_string[1:-1].split(",") if len(array_as_string) > 2 else None
 
+    def __init__(self, f):
+        self.f = f
+        self.lines = 0
+
+    def write(self, b):
+        self.lines += b.count(b"\n")
+        return self.f.write(b)
 
-def convert_postgres_json_array_as_string_to_json(json_array_as_string: str) -> dict:
-    """
-        Postgres JSON arrays (jsonb) are stored in CSVs as strings. Elasticsearch is able to handle
-        JSON arrays with nested types, but needs to be passed a list JSON instead of a string.
-        In the case of an empty array, return null.
-    """
-    return json.loads(json_array_as_string) if json_array_as_string else None
+
+# ==============================================================================
+# Helper functions for several Django management commands focused on ETL into a Elasticsearch cluster
+# ==============================================================================
 
 
 def process_guarddog(process_list):
@@ -200,51 +205,20 @@ def process_guarddog(process_list):
     return False
 
 
-def configure_sql_strings(config, filename, deleted_ids):
+def configure_sql_strings(config):
     """
     Populates the formatted strings defined globally in this file to create the desired SQL
     """
     update_date_str = UPDATE_DATE_SQL.format(config["starting_date"].strftime("%Y-%m-%d"))
 
     copy_sql = COPY_SQL.format(
+        columns=SELECT_LIST,
         fy=config["fiscal_year"],
         update_date=update_date_str,
-        filename=filename,
         view=settings.ES_TRANSACTIONS_ETL_VIEW_NAME,
     )
 
-    count_sql = COUNT_SQL.format(
-        fy=config["fiscal_year"], update_date=update_date_str, view=settings.ES_TRANSACTIONS_ETL_VIEW_NAME
-    )
-
-    if deleted_ids and config["process_deletes"]:
-        id_list = ",".join(["('{}')".format(x) for x in deleted_ids.keys()])
-        id_sql = CHECK_IDS_SQL.format(id_list=id_list, fy=config["fiscal_year"])
-    else:
-        id_sql = None
-
-    return copy_sql, id_sql, count_sql
-
-
-def execute_sql_statement(cmd, results=False, verbose=False):
-    """ Simple function to execute SQL using a psycopg2 connection"""
-    rows = None
-    if verbose:
-        print(cmd)
-
-    with psycopg2.connect(dsn=get_database_dsn_string()) as connection:
-        connection.autocommit = True
-        with connection.cursor() as cursor:
-            cursor.execute(cmd)
-            if results:
-                rows = db_rows_to_dict(cursor)
-    return rows
-
-
-def db_rows_to_dict(cursor):
-    """ Return a dictionary of all row results from a database connection cursor """
-    columns = [col[0] for col in cursor.description]
-    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return copy_sql
 
 
 def download_db_records(fetch_jobs, done_jobs, config):
@@ -252,35 +226,39 @@ def download_db_records(fetch_jobs, done_jobs, config):
     # contains multiple jobs. Wait a few seconds before starting to see if it helps
     sleep(5)
     printf({"msg": "Queue has items: {}".format(not fetch_jobs.empty()), "f": "Download"})
-    while not fetch_jobs.empty():
-        if done_jobs.full():
-            printf({"msg": "Paused downloading new CSVs so ES indexing can catch up", "f": "Download"})
-            sleep(60)
-        else:
-            start = perf_counter()
-            job = fetch_jobs.get_nowait()
-            printf({"msg": 'Preparing to download "{}"'.format(job.csv), "job": job.name, "f": "Download"})
-
-            sql_config = {
-                "starting_date": config["starting_date"],
-                "fiscal_year": job.fy,
-                "process_deletes": config["process_deletes"],
-            }
-            copy_sql, _, count_sql = configure_sql_strings(sql_config, job.csv, [])
-
-            if os.path.isfile(job.csv):
-                os.remove(job.csv)
-
-            job.count = download_csv(count_sql, copy_sql, job.csv, job.name, config["skip_counts"], config["verbose"])
-            done_jobs.put(job)
-            printf(
-                {
-                    "msg": 'CSV "{}" copy took {} seconds'.format(job.csv, perf_counter() - start),
-                    "job": job.name,
-                    "f": "Download",
-                }
-            )
-            sleep(1)
+    # One connection per download process, reused for every fiscal year's COPY and closed when the loop ends
+    # (or a COPY fails), so a broken connection is never carried over to another job
+    with closing(psycopg2.connect(dsn=get_database_dsn_string())) as connection:
+        connection.autocommit = True
+        while not fetch_jobs.empty():
+            if done_jobs.full():
+                printf({"msg": "Paused downloading new CSVs so ES indexing can catch up", "f": "Download"})
+                sleep(60)
+            else:
+                start = perf_counter()
+                job = fetch_jobs.get_nowait()
+                printf({"msg": 'Preparing to download "{}"'.format(job.csv), "job": job.name, "f": "Download"})
+
+                sql_config = {"starting_date": config["starting_date"], "fiscal_year": job.fy}
+                copy_sql = configure_sql_strings(sql_config)
+
+                if os.path.exists(job.csv):
+                    os.remove(job.csv)
+
+                # The "CSV" is a named pipe: the COPY output streams straight into the ES ingest process without
+                # ever landing on disk. The job is queued first so the reader can open the other end of the pipe.
+                # The COPY stays open until ES has indexed the whole year (see the es_rapidloader docstring).
+                os.mkfifo(job.csv)
+                done_jobs.put(job)
+                download_csv(connection, copy_sql, job.csv, job.name, config["skip_counts"])
+                printf(
+                    {
+                        "msg": 'CSV "{}" copy took {} seconds'.format(job.csv, perf_counter() - start),
+                        "job": job.name,
+                        "f": "Download",
+                    }
+                )
+                sleep(1)
 
     # This "Null Job" is used to notify the other (ES data load) process this is the final job
     done_jobs.put(DataJob(None, None, None, None))
@@ -288,38 +266,51 @@ def download_db_records(fetch_jobs, done_jobs, config):
     return
 
 
-def download_csv(count_sql, copy_sql, filename, job_id, skip_counts, verbose):
+def download_csv(connection, copy_sql, filename, job_id, skip_counts):
     if skip_counts:
-        count = None
         printf({"msg": "Skipping count checks. Writing file: {}".format(filename), "job": job_id, "f": "Download"})
     else:
-        count = execute_sql_statement(count_sql, True, verbose)[0]["count"]
-        printf({"msg": "Writing {} to this file: {}".format(count, filename), "job": job_id, "f": "Download"})
-    # It is preferable to not use shell=True, but this command works. Limited user-input so risk is low
-    subprocess.Popen('psql "${{DATABASE_URL}}" -c {}'.format(copy_sql), shell=True).wait()
-
-    if not skip_counts:
-        download_count = count_rows_in_delimited_file(filename, has_header=True, safe=False)
-        if count != download_count:
-            msg = "Mismatch between CSV and DB rows! Expected: {} | Actual {} in: {}"
-            printf({"msg": msg.format(count, download_count, filename), "job": job_id, "f": "Download"})
-            raise SystemExit(1)
+        printf({"msg": "Writing to this file: {}".format(filename), "job": job_id, "f": "Download"})
+
+    count = None
+    # Stream the COPY output over the caller's connection straight into the file (no psql subprocess)
+    with connection.cursor() as cursor, open(filename, "wb") as f:
+        if skip_counts:
+            cursor.copy_expert(copy_sql, f)
+        else:
+            # Rows are tallied as they stream through the pipe instead of running a second COUNT(*) against the view
+            writer = LineCountingWriter(f)
+            cursor.copy_expert(copy_sql, writer)
+            count = writer.lines
+
+    if count is not None:
+        printf({"msg": "Wrote {} rows to {}".format(count, filename), "job": job_id, "f": "Download"})
     return count
 
 
-def csv_chunk_gen(filename, chunksize, job_id):
-    printf({"msg": "Opening {} (batch size = {})".format(filename, chunksize), "job": job_id, "f": "ES Ingest"})
-    # Need a specific converter to handle converting strings to correct data types (e.g. string -> array)
-    converters = {
-        "business_categories": convert_postgres_array_as_string_to_list,
-        "treasury_accounts": convert_postgres_json_array_as_string_to_json,
-        "federal_accounts": convert_postgres_json_array_as_string_to_json,
-    }
-    # Panda's data type guessing causes issues for Elasticsearch. Explicitly cast using dictionary
-    dtype = {k: str for k in VIEW_COLUMNS if k not in converters}
-    for file_df in pd.read_csv(filename, dtype=dtype, converters=converters, header=0, chunksize=chunksize):
-        file_df = file_df.where(cond=(pd.notnull(file_df)), other=None)
-        yield file_df.to_dict(orient="records")
+def csv_chunk_gen(filename, job_id):
+    msg = "Opening {} (max batch size = {})".format(filename, ES_MAX_BATCH_DOCS)
+    printf({"msg": msg, "job": job_id, "f": "ES Ingest"})
+    # Each line is a complete JSON document produced by Postgres, so no per-column conversion is needed
+    with open(filename, "rb") as f:
+        chunksize = None
+        sample_bytes = 0
+        chunk = []
+        for line in f:
+            chunk.append(json.loads(line))
+            if chunksize is None:
+                # Size the batches from the serialized size of the first documents (chunk <= max bytes / avg doc)
+                sample_bytes += len(line)
+                if len(chunk) == CHUNK_SIZE_SAMPLE_DOCS:
+                    chunksize = max(1, min(ES_MAX_BATCH_DOCS, int(ES_MAX_CHUNK_BYTES / (sample_bytes / len(chunk)))))
+                    msg = "Batch size set to {} from an average document size of {} bytes"
+                    printf({"msg": msg.format(chunksize, sample_bytes // len(chunk)), "job": job_id, "f": "ES Ingest"})
+            # A loop rather than a single check: the sampled documents are split down if chunksize is smaller
+            while chunksize is not None and len(chunk) >= chunksize:
+                yield chunk[:chunksize]
+                chunk = chunk[chunksize:]
+        if chunk:
+            yield chunk
 
 
 def es_data_loader(client, fetch_jobs, done_jobs, config):
@@ -347,10 +338,29 @@ def es_data_loader(client, fetch_jobs, done_jobs, config):
 def streaming_post_to_es(client, chunk, index_name, job_id=None):
     success, failed = 0, 0
     try:
-        # "doc_type" is set in the index templete file. Don't change this without changing in json file first
-        for ok, item in helpers.streaming_bulk(client, chunk, index=index_name, doc_type="transaction_mapping"):
-            success = [success, success + 1][ok]
-            failed = [failed + 1, failed][ok]
+        # "_type" is set in the index templete file. Don't change this without changing in json file first
+        # Using the transaction's unique id as "_id" makes "index" overwrite any existing copy of the document
+        actions = (
+            {
+                "_op_type": "index",
+                "_index": index_name,
+                "_type": "transaction_mapping",
+                "_id": doc[UNIVERSAL_TRANSACTION_ID_NAME],
+                "_source": doc,
+            }
+            for doc in chunk
+        )
+        # Bulk requests are sent concurrently; max_chunk_bytes keeps each request well below http.max_content_length
+        for ok, item in helpers.parallel_bulk(
+            client,
+            actions,
+            thread_count=ES_BULK_THREAD_COUNT,
+            chunk_size=ES_BULK_CHUNK_SIZE,
+            max_chunk_bytes=ES_MAX_CHUNK_BYTES,
+            queue_size=4,
+        ):
+            success += ok
+            failed += not ok
 
     except Exception as e:
         print("Fatal error: \n\n{}...\n\n{}".format(str(e)[:5000], "*" * 80))
@@ -360,11 +370,9 @@ def streaming_post_to_es(client, chunk, index_name, job_id=None):
     return success, failed
 
 
-def put_alias(client, index, alias_name, alias_body):
-    client.indices.put_alias(index, alias_name, body=alias_body)
-
-
-def create_aliases(client, index, silent=False):
+def add_alias_actions(index, silent=False):
+    """Return the "add" actions for an update_aliases request which put every API and write alias on the index"""
+    actions = []
     for award_type, award_type_codes in INDEX_ALIASES_TO_AWARD_TYPES.items():
         alias_name = "{}-{}".format(settings.ES_TRANSACTIONS_QUERY_ALIAS_PREFIX, award_type)
         if silent is False:
@@ -375,8 +383,7 @@ def create_aliases(client, index, silent=False):
                     "f": "ES Alias Put",
                 }
             )
-        alias_body = {"filter": {"terms": {"type": award_type_codes}}}
-        put_alias(client, index, alias_name, alias_body)
+        actions.append({"add": {"index": index, "alias": alias_name, "filter": {"terms": {"type": award_type_codes}}}})
 
     # ensure the new index is added to the alias used for incremental loads.
     # If the alias is on multiple indexes, the loads will fail!
@@ -387,7 +394,12 @@ def create_aliases(client, index, silent=False):
             "f": "ES Alias Put",
         }
     )
-    put_alias(client, index, settings.ES_TRANSACTIONS_WRITE_ALIAS, {})
+    actions.append({"add": {"index": index, "alias": settings.ES_TRANSACTIONS_WRITE_ALIAS}})
+    return actions
+
+
+def create_aliases(client, index, silent=False):
+    client.indices.update_aliases(body={"actions": add_alias_actions(index, silent)})
 
 
 def set_final_index_config(client, index):
@@ -406,22 +418,25 @@ def set_final_index_config(client, index):
 
 
 def swap_aliases(client, index):
+    # All alias removals and additions are sent as one atomic update_aliases request
+    actions = []
     if client.indices.get_alias(index, "*"):
         printf({"msg": 'Removing old aliases for index "{}"'.format(index), "job": None, "f": "ES Alias Drop"})
-        client.indices.delete_alias(index, "_all")
+        actions.append({"remove": {"index": index, "alias": "*"}})
 
     alias_patterns = settings.ES_TRANSACTIONS_QUERY_ALIAS_PREFIX + "*"
     old_indexes = []
 
     try:
-        old_indexes = list(client.indices.get_alias("*", alias_patterns).keys())
+        old_indexes = [i for i in client.indices.get_alias("*", alias_patterns).keys() if i != index]
         for old_index in old_indexes:
-            client.indices.delete_alias(old_index, "_all")
+            actions.append({"remove": {"index": old_index, "alias": "*"}})
             printf({"msg": 'Removing aliases from "{}"'.format(old_index), "job": None, "f": "ES Alias Drop"})
     except Exception:
         printf({"msg": "ERROR: no aliases found for {}".format(alias_patterns), "f": "ES Alias Drop"})
 
-    create_aliases(client, index)
+    actions.extend(add_alias_actions(index))
+    client.indices.update_aliases(body={"actions": actions})
 
     try:
         if old_indexes:
@@ -431,7 +446,7 @@ def swap_aliases(client, index):
         printf({"msg": "ERROR: Unable to delete indexes: {}".format(old_indexes), "f": "ES Alias Drop"})
 
 
-def post_to_elasticsearch(client, job, config, chunksize=250000):
+def post_to_elasticsearch(client, job, config):
     printf({"msg": 'Populating ES Index "{}"'.format(job.index), "job": job.name, "f": "ES Ingest"})
     start = perf_counter()
     try:
@@ -444,24 +459,16 @@ def post_to_elasticsearch(client, job, config, chunksize=250000):
         client.indices.create(index=job.index)
         client.indices.refresh(job.index)
 
-    csv_generator = csv_chunk_gen(job.csv, chunksize, job.name)
+    rows_posted = 0
+    csv_generator = csv_chunk_gen(job.csv, job.name)
     for count, chunk in enumerate(csv_generator):
         if len(chunk) == 0:
-            printf({"msg": "No documents to add/delete for chunk #{}".format(count), "f": "ES Ingest", "job": job.name})
+            printf({"msg": "No documents to add for chunk #{}".format(count), "f": "ES Ingest", "job": job.name})
             continue
         iteration = perf_counter()
-        if config["process_deletes"]:
-            id_list = [{"key": c[UNIVERSAL_TRANSACTION_ID_NAME], "col": UNIVERSAL_TRANSACTION_ID_NAME} for c in chunk]
-            delete_transactions_from_es(client, id_list, job.name, config, job.index)
-
-        current_rows = "({}-{})".format(count * chunksize + 1, count * chunksize + len(chunk))
-        printf(
-            {
-                "msg": "Streaming to ES #{} rows [{}/{}]".format(count, current_rows, job.count),
-                "job": job.name,
-                "f": "ES Ingest",
-            }
-        )
+        current_rows = "({}-{})".format(rows_posted + 1, rows_posted + len(chunk))
+        rows_posted += len(chunk)
+        printf({"msg": "Streaming to ES #{} rows {}".format(count, current_rows), "job": job.name, "f": "ES Ingest"})
         streaming_post_to_es(client, chunk, job.index, job.name)
         printf(
             {
@@ -481,8 +488,7 @@ def post_to_elasticsearch(client, job, config, chunksize=250000):
 
 def deleted_transactions(client, config):
     deleted_ids = gather_deleted_ids(config)
-    id_list = [{"key": deleted_id, "col": UNIVERSAL_TRANSACTION_ID_NAME} for deleted_id in deleted_ids]
-    delete_transactions_from_es(client, id_list, None, config, None)
+    delete_transactions_from_es(client, deleted_ids, None, config, None)
 
 
 def take_snapshot(client, index, repository):
@@ -536,31 +542,17 @@ def gather_deleted_ids(config):
 
     deleted_ids = {}
 
-    for obj in filtered_csv_list:
-        # Use temporary files to facilitate date moving from csv files on S3 into pands
-        (file, file_path) = tempfile.mkstemp()
-        bucket.download_file(obj.key, file_path)
+    # Files are processed oldest first so the most recent timestamp for an id is the last one written
+    filtered_csv_list.sort(key=lambda x: x.last_modified)
 
-        # Ingests the CSV into a dataframe. pandas thinks some ids are dates, so disable parsing
-        data = pd.read_csv(file_path, dtype=str)
-
-        if "detached_award_proc_unique" in data:
-            new_ids = ["CONT_TX_" + x.upper() for x in data["detached_award_proc_unique"].values]
-        elif "afa_generated_unique" in data:
-            new_ids = ["ASST_TX_" + x.upper() for x in data["afa_generated_unique"].values]
-        else:
-            printf({"msg": "  [Missing valid col] in {}".format(obj.key)})
-
-        # Next statements are ugly, but properly handle the temp files
-        os.close(file)
-        os.remove(file_path)
-
-        for uid in new_ids:
-            if uid in deleted_ids:
-                if deleted_ids[uid]["timestamp"] < obj.last_modified:
-                    deleted_ids[uid]["timestamp"] = obj.last_modified
-            else:
-                deleted_ids[uid] = {"timestamp": obj.last_modified}
+    # S3 GETs are I/O bound so the objects are fetched and parsed concurrently. The boto3 client is thread-safe,
+    # and the results are merged here in the main thread (in the sorted order) so no locking is needed.
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = executor.map(lambda obj: gather_deleted_ids_from_s3_object(s3.meta.client, obj), filtered_csv_list)
+        for new_ids, last_modified in results:
+            # One timestamp dict is shared by all ids from the same file
+            timestamp = {"timestamp": last_modified}
+            deleted_ids.update((uid, timestamp) for uid in new_ids)
 
     if config["verbose"]:
         for uid, deleted_dict in deleted_ids.items():
@@ -570,60 +562,86 @@ def gather_deleted_ids(config):
     return deleted_ids
 
 
-def filter_query(column, values, query_type="match_phrase"):
-    queries = [{query_type: {column: str(i)}} for i in values]
-    return {"query": {"bool": {"should": [queries]}}}
+def gather_deleted_ids_from_s3_object(s3_client, obj):
+    """Stream one CSV of deleted transactions from S3 and return its transaction ids with the object's timestamp"""
+    body = s3_client.get_object(Bucket=obj.bucket_name, Key=obj.key)["Body"]
+    reader = csv.reader(codecs.getreader("utf-8-sig")(body))
+    header = next(reader, [])
+
+    if "detached_award_proc_unique" in header:
+        col_idx, prefix = header.index("detached_award_proc_unique"), "CONT_TX_"
+    elif "afa_generated_unique" in header:
+        col_idx, prefix = header.index("afa_generated_unique"), "ASST_TX_"
+    else:
+        printf({"msg": "  [Missing valid col] in {}".format(obj.key)})
+        return [], obj.last_modified
+
+    # Blank or short lines (e.g. a trailing newline) carry no id and are skipped
+    return [prefix + row[col_idx].upper() for row in reader if len(row) > col_idx and row[col_idx]], obj.last_modified
+
+
+def filter_query(values):
+    """
+        Documents are indexed with generated_unique_transaction_id as their "_id". That field itself is analyzed
+        text, so an exact-match lookup has to go through "_id" instead of a terms query on the field.
+    """
+    return {"query": {"ids": {"type": "transaction_mapping", "values": [str(i) for i in values]}}}
 
 
-def delete_query(response):
-    return {"query": {"ids": {"type": "transaction_mapping", "values": [i["_id"] for i in response["hits"]["hits"]]}}}
+def chunks(iterable, n):
+    """Yield successive n-sized lists from any iterable (including generators)."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, n))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, n))
 
 
-def chunks(l, n):
-    """Yield successive n-sized chunks from l."""
-    for i in range(0, len(l), n):
-        yield l[i : i + n]
+def index_uses_unique_transaction_id_as_doc_id(client, index):
+    """
+        Only indexes created from the current template index documents with generated_unique_transaction_id as
+        their "_id" (recorded in the mapping's "_meta"). Older indexes use auto-generated ids, so re-indexing a
+        transaction into them adds a duplicate instead of overwriting it, and deletes by "_id" find nothing.
+    """
+    for index_mappings in client.indices.get_mapping(index=index).values():
+        meta = index_mappings["mappings"].get("transaction_mapping", {}).get("_meta", {})
+        if meta.get("document_id") != UNIVERSAL_TRANSACTION_ID_NAME:
+            return False
+    return True
 
 
 def delete_transactions_from_es(client, id_list, job_id, config, index=None):
     """
-    id_list = [{key:'key1',col:'tranaction_id'},
-               {key:'key2',col:'generated_unique_transaction_id'}],
-               ...]
+    id_list = iterable of the generated_unique_transaction_id (document "_id") values to delete
     """
     start = perf_counter()
 
-    printf({"msg": "Deleting up to {} document(s)".format(len(id_list)), "f": "ES Delete", "job": job_id})
-
     if index is None:
         index = "{}-*".format(config["root_index"])
-    start_ = client.search(index=index)["hits"]["total"]
-    printf({"msg": "Starting amount of indices ----- {}".format(start_), "f": "ES Delete", "job": job_id})
-    col_to_items_dict = defaultdict(list)
-    for l in id_list:
-        col_to_items_dict[l["col"]].append(l["key"])
-
-    for column, values in col_to_items_dict.items():
-        printf({"msg": 'Deleting {} of "{}"'.format(len(values), column), "f": "ES Delete", "job": job_id})
-        values_generator = chunks(values, 1000)
-        for v in values_generator:
-            # IMPORTANT: This delete routine looks at just 1 index at a time. If there are duplicate records across
-            # multiple indexes, those duplicates will not be caught by this routine. It is left as is because at the
-            # time of this comment, we are migrating to using a single index.
-            body = filter_query(column, v)
-            response = client.search(index=index, body=json.dumps(body), size=config["max_query_size"])
-            delete_body = delete_query(response)
-            try:
-                client.delete_by_query(
-                    index=index, body=json.dumps(delete_body), refresh=True, size=config["max_query_size"]
-                )
-            except Exception as e:
-                printf({"msg": "[ERROR][ERROR][ERROR]\n{}".format(str(e)), "f": "ES Delete", "job": job_id})
-    end_ = client.search(index=index)["hits"]["total"]
+    if config["verbose"]:
+        start_ = client.count(index=index)["count"]
+        printf({"msg": "Starting amount of indices ----- {}".format(start_), "f": "ES Delete", "job": job_id})
+
+    delete_count = 0
+    for v in chunks(id_list, 10000):
+        # IMPORTANT: This delete routine looks at just 1 index at a time. If there are duplicate records across
+        # multiple indexes, those duplicates will not be caught by this routine. It is left as is because at the
+        # time of this comment, we are migrating to using a single index.
+        delete_count += len(v)
+        body = filter_query(v)
+        try:
+            client.delete_by_query(index=index, body=body, conflicts="proceed", slices="auto", refresh=False)
+        except Exception as e:
+            printf({"msg": "[ERROR][ERROR][ERROR]\n{}".format(str(e)), "f": "ES Delete", "job": job_id})
+    printf({"msg": "Sent {} id(s) for deletion".format(delete_count), "f": "ES Delete", "job": job_id})
+    client.indices.refresh(index)
 
     t = perf_counter() - start
-    total = str(start_ - end_)
-    printf({"msg": "ES Deletes took {}s. Deleted {} records".format(t, total), "f": "ES Delete", "job": job_id})
+    if config["verbose"]:
+        total = str(start_ - client.count(index=index)["count"])
+        printf({"msg": "ES Deletes took {}s. Deleted {} records".format(t, total), "f": "ES Delete", "job": job_id})
+    else:
+        printf({"msg": "ES Deletes took {}s".format(t), "f": "ES Delete", "job": job_id})
     return
 
 
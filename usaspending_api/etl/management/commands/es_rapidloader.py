@@ -15,6 +15,7 @@ from usaspending_api.etl.es_etl_helpers import (
     deleted_transactions,
     download_db_records,
     es_data_loader,
+    index_uses_unique_transaction_id_as_doc_id,
     printf,
     process_guarddog,
     set_final_index_config,
@@ -29,11 +30,22 @@ class Command(BaseCommand):
     HIGHLEVEL PROCESS OVERVIEW
          1. Generate the full list of fiscal years to process as jobs
          2. Iterate by job
-           a. Download a CSV file by year (one at a time)
-               i. Continue to download a CSV file until all years are downloaded
-           b. Upload a CSV to Elasticsearch
-               i. Continue to upload a CSV file until all years are uploaded to ES
-           c. Delete CSV file
+           a. Stream a CSV by year (one at a time) from PostgreSQL into a named pipe
+               i. Continue to stream CSVs until all years are downloaded
+           b. Upload the CSV from the named pipe to Elasticsearch as it streams
+               i. Continue to upload CSVs until all years are uploaded to ES
+           c. Delete the named pipe
+
+    NOTE ON THE NAMED PIPES:
+        The pipe only drains as fast as Elasticsearch indexes, so each fiscal year's COPY statement (and its
+        snapshot) stays open on PostgreSQL for as long as that year takes to index. This trade-off is accepted to
+        avoid writing each year to disk first, but it means:
+        - Long-running statements hold back vacuum on the source database for the duration of the load
+        - Run against the primary (or a replica with hot_standby_feedback / generous max_standby_streaming_delay),
+          otherwise recovery conflicts can cancel the COPY mid-stream
+        - If the COPY fails mid-stream the download process exits with an error and the whole ETL is aborted,
+          which replaces the old CSV/DB row count comparison as the guard against a short stream
+        - --dir must be on a local filesystem that supports FIFOs (e.g. not a network or FUSE mount)
     TO RELOAD ALL data:
         python3 manage.py es_rapidloader --index-name <NEW-INDEX-NAME> --create-new-index all
 
@@ -66,7 +78,7 @@ class Command(BaseCommand):
             "--dir",
             default=str(Path(__file__).resolve().parent),
             type=str,
-            help="Set for a custom location of output files",
+            help="Set for a custom location of the named pipes used to stream CSV data. Must support FIFOs",
             dest="directory",
         )
         parser.add_argument(
@@ -230,8 +242,6 @@ def process_cli_parameters(options: dict, es_client) -> None:
         #   And keep it timezone-award for S3
         config["starting_date"] = get_last_load_date("es_transactions", default=default_datetime)
 
-    config["max_query_size"] = settings.ES_TRANSACTIONS_MAX_RESULT_WINDOW
-
     config["is_incremental_load"] = not bool(config["create_new_index"]) and (
         config["starting_date"] != default_datetime
     )
@@ -244,6 +254,10 @@ def process_cli_parameters(options: dict, es_client) -> None:
         if not es_client.cat.aliases(name=settings.ES_TRANSACTIONS_WRITE_ALIAS):
             printf({"msg": "Fatal error: write alias '{}' is missing".format(settings.ES_TRANSACTIONS_WRITE_ALIAS)})
             raise SystemExit(1)
+        if not index_uses_unique_transaction_id_as_doc_id(es_client, settings.ES_TRANSACTIONS_WRITE_ALIAS):
+            msg = "Fatal error: index behind '{}' predates id-based document ids. Reload with --create-new-index first"
+            printf({"msg": msg.format(settings.ES_TRANSACTIONS_WRITE_ALIAS)})
+            raise SystemExit(1)
     else:
         if es_client.indices.exists(config["index_name"]):
             printf({"msg": "Fatal error: data load into existing index. Change index name or run an incremental load"})
@@ -0,0 +1,109 @@
+import pytest
+
+from datetime import datetime, timezone
+from django.db import connection
+from model_mommy import mommy
+
+from usaspending_api.common.elasticsearch.elasticsearch_sql_helpers import ensure_transaction_etl_view_exists
+from usaspending_api.etl.es_etl_helpers import (
+    configure_sql_strings,
+    csv_chunk_gen,
+    delete_transactions_from_es,
+    download_csv,
+    index_uses_unique_transaction_id_as_doc_id,
+    streaming_post_to_es,
+)
+
+
+@pytest.fixture
+def award_data_fixture(db):
+    mommy.make("references.LegalEntity", legal_entity_id=1)
+    mommy.make("awards.TransactionNormalized", id=1, award_id=1, action_date="2010-10-01", is_fpds=True, type="A")
+    mommy.make("awards.TransactionFPDS", transaction_id=1, detached_award_proc_unique="abc-1-def", piid="0001")
+    mommy.make("awards.Award", id=1, latest_transaction_id=1, recipient_id=1, is_fpds=True, type="A", piid="0001")
+
+    mommy.make("references.LegalEntity", legal_entity_id=2)
+    mommy.make("awards.TransactionNormalized", id=2, award_id=2, action_date="2010-10-01", is_fpds=True, type="A")
+    mommy.make("awards.TransactionFPDS", transaction_id=2, detached_award_proc_unique="abc-2-def", piid="0002")
+    mommy.make("awards.Award", id=2, latest_transaction_id=2, recipient_id=2, is_fpds=True, type="A", piid="0002")
+
+
+def test_delete_transactions_from_es(award_data_fixture, elasticsearch_transaction_index):
+    elasticsearch_transaction_index.update_index()
+    client = elasticsearch_transaction_index.client
+    index = elasticsearch_transaction_index.index_name
+    doc_type = elasticsearch_transaction_index.doc_type
+    assert client.count(index=index)["count"] == 2
+
+    config = {"root_index": elasticsearch_transaction_index.alias_prefix, "verbose": False}
+    delete_transactions_from_es(client, ["CONT_TX_ABC-1-DEF"], None, config, index)
+
+    assert client.count(index=index)["count"] == 1
+    assert not client.exists(index, doc_type, "CONT_TX_ABC-1-DEF")
+    assert client.exists(index, doc_type, "CONT_TX_ABC-2-DEF")
+
+
+def test_index_uses_unique_transaction_id_as_doc_id(db, elasticsearch_transaction_index):
+    elasticsearch_transaction_index.update_index()
+    client = elasticsearch_transaction_index.client
+    assert index_uses_unique_transaction_id_as_doc_id(client, elasticsearch_transaction_index.index_name)
+
+    legacy_index = "{}-legacy".format(elasticsearch_transaction_index.index_name)
+    client.indices.create(legacy_index)
+    try:
+        assert not index_uses_unique_transaction_id_as_doc_id(client, legacy_index)
+    finally:
+        client.indices.delete(legacy_index)
+
+
+def test_etl_document_source_types(transactional_db, elasticsearch_transaction_index, tmp_path):
+    """
+    Documents loaded through the ETL (COPY -> pipe -> bulk) must keep the "_source" shape the API returns:
+    scalars as strings, empty arrays as null, and the account columns as JSON
+    """
+    mommy.make("references.LegalEntity", legal_entity_id=1)
+    mommy.make(
+        "awards.TransactionNormalized",
+        id=1,
+        award_id=1,
+        action_date="2010-10-01",
+        is_fpds=True,
+        type="A",
+        federal_action_obligation="15639242.36",
+        business_categories=[],
+    )
+    mommy.make("awards.TransactionFPDS", transaction_id=1, detached_award_proc_unique="abc-1-def", piid="0001")
+    mommy.make(
+        "awards.Award",
+        id=1,
+        latest_transaction_id=1,
+        recipient_id=1,
+        is_fpds=True,
+        type="A",
+        piid="0001",
+        total_obligation="10497321.20",
+    )
+    ensure_transaction_etl_view_exists()
+    with connection.cursor() as cursor:
+        cursor.execute("REFRESH MATERIALIZED VIEW universal_transaction_matview;")
+
+    client = elasticsearch_transaction_index.client
+    index = elasticsearch_transaction_index.index_name
+    client.indices.create(index, elasticsearch_transaction_index.template)
+
+    sql_config = {"starting_date": datetime(2007, 10, 1, tzinfo=timezone.utc), "fiscal_year": 2011}
+    filename = str(tmp_path / "2011_transactions.csv")
+    assert download_csv(connection, configure_sql_strings(sql_config), filename, None, False) == 1
+    docs = [doc for chunk in csv_chunk_gen(filename, None) for doc in chunk]
+    streaming_post_to_es(client, docs, index)
+    client.indices.refresh(index)
+
+    source = client.get(index, elasticsearch_transaction_index.doc_type, "CONT_TX_ABC-1-DEF")["_source"]
+    assert source["transaction_id"] == "1"
+    assert source["transaction_fiscal_year"] == "2011"
+    assert source["transaction_amount"] == "15639242.36"
+    assert source["award_amount"] == "10497321.20"
+    assert source["action_date"] == "2010-10-01"
+    assert source["piid"] == "0001"
+    assert source["business_categories"] is None
+    assert source["treasury_accounts"] is None
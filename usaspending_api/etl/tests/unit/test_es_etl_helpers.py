@@ -0,0 +1,47 @@
+import json
+
+from datetime import datetime, timezone
+from io import BytesIO
+from types import SimpleNamespace
+
+from usaspending_api.etl import es_etl_helpers
+from usaspending_api.etl.es_etl_helpers import csv_chunk_gen, gather_deleted_ids_from_s3_object
+
+
+class FakeS3Client:
+    def __init__(self, contents):
+        self.contents = contents
+
+    def get_object(self, Bucket, Key):
+        return {"Body": BytesIO(self.contents)}
+
+
+def test_gather_deleted_ids_from_s3_object_skips_blank_lines():
+    last_modified = datetime(2019, 10, 1, tzinfo=timezone.utc)
+    obj = SimpleNamespace(bucket_name="bucket", key="deletes.csv", last_modified=last_modified)
+    s3_client = FakeS3Client(b"detached_award_proc_unique,other\nabc-1,x\n\n,y\nabc-2\n\n")
+
+    ids, timestamp = gather_deleted_ids_from_s3_object(s3_client, obj)
+
+    assert ids == ["CONT_TX_ABC-1", "CONT_TX_ABC-2"]
+    assert timestamp == last_modified
+
+
+def test_gather_deleted_ids_from_s3_object_assistance_ids():
+    obj = SimpleNamespace(bucket_name="bucket", key="deletes.csv", last_modified=None)
+    s3_client = FakeS3Client(b"afa_generated_unique\nabc-1\n")
+
+    assert gather_deleted_ids_from_s3_object(s3_client, obj) == (["ASST_TX_ABC-1"], None)
+
+
+def test_csv_chunk_gen_splits_sampled_documents_to_chunksize(monkeypatch, tmp_path):
+    line = json.dumps({"piid": "x" * 20}) + "\n"
+    # Room for exactly 50 documents per batch, well below the 200 documents sampled to size the batches
+    monkeypatch.setattr(es_etl_helpers, "ES_MAX_CHUNK_BYTES", len(line) * 50)
+    filename = tmp_path / "transactions.csv"
+    filename.write_text(line * 420)
+
+    chunks = list(csv_chunk_gen(str(filename), None))
+
+    assert [len(chunk) for chunk in chunks] == [50] * 8 + [20]
+    assert chunks[0][0] == {"piid": "x" * 20}